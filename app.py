@@ -3,6 +3,7 @@ from flask import Flask
 from flask_cors import CORS
 from routes.main_router import main_router
 from config.mongodb import mongodb_connection, ensure_mongodb_connection
+from services import warmup_langchain_chatbot_service
 import logging
 import atexit
 
@@ -22,6 +23,13 @@ except Exception as e:
     # You can choose to exit here or continue without MongoDB
     # raise SystemExit(f"Cannot start application without MongoDB: {e}")
 
+# Warm up the chatbot service (ChromaDB, MongoDB pool, embedder, LLM client) before serving requests
+if os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true":
+    try:
+        warmup_langchain_chatbot_service()
+    except Exception as e:
+        logger.error(f"[App] Failed to warm up chatbot service: {e}")
+
 # Register cleanup function
 def cleanup():
     """Cleanup function to close MongoDB connection on app shutdown"""
@@ -1,7 +1,15 @@
 import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
 
 CHROMA_DB_PATH = os.path.join(os.getcwd(), "chromaDB")
 
+# Chroma server (HTTP client mode); when CHROMA_HTTP_HOST is unset the embedded PersistentClient is used
+CHROMA_HTTP_HOST = os.getenv("CHROMA_HTTP_HOST")
+CHROMA_HTTP_PORT = int(os.getenv("CHROMA_HTTP_PORT", 8000))
+
 def ensure_chroma_db_folder():
 	"""Ensure the ChromaDB folder exists."""
 	if not os.path.exists(CHROMA_DB_PATH):
@@ -11,4 +19,7 @@ def ensure_chroma_db_folder():
 	else:
 		print(f"[ChromaDB] ChromaDB folder exists at: {CHROMA_DB_PATH}")
 
-ensure_chroma_db_folder()
\ No newline at end of file
+if CHROMA_HTTP_HOST:
+	print(f"[ChromaDB] Using Chroma server at: {CHROMA_HTTP_HOST}:{CHROMA_HTTP_PORT}")
+else:
+	ensure_chroma_db_folder()
\ No newline at end of file
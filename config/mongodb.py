@@ -22,6 +22,13 @@ for param, value in CONFIG.items():
         raise ValueError(f"[MongoDB] Environment variable '{param}' is missing or empty. Please provide a correct field value.")
 
 
+# Connection pool sizing: (cores * 2) + 1 connections per process
+MONGODB_POOL_CONFIG = {
+    "maxPoolSize": int(os.getenv('MONGODB_MAX_POOL_SIZE', (os.cpu_count() or 1) * 2 + 1)),
+    "minPoolSize": int(os.getenv('MONGODB_MIN_POOL_SIZE', 2)),
+    "waitQueueTimeoutMS": int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+}
+
 MONGODB_URL = f"mongodb+srv://{CONFIG['MONGODB_USERNAME']}:{CONFIG['MONGODB_PASSWORD']}@{CONFIG['MONGODB_CLUSTER_NAME'].lower()}.{CONFIG['MONGODB_CLUSTER_ID']}.mongodb.net/?retryWrites=true&w=majority&appName={CONFIG['MONGODB_CLUSTER_NAME']}"
 
 # Configure logging
@@ -53,7 +60,8 @@ class MongoDBConnection:
             self._client = MongoClient(
                 MONGODB_URL,
                 retryWrites=True,
-                w='majority'  # Write concern
+                w='majority',  # Write concern
+                **MONGODB_POOL_CONFIG
             )
             
             # Test the connection
@@ -12,6 +12,7 @@ from .document import UploadModel
 
 class ConversationEntry(BaseModel):
     """Individual conversation entry in chat history"""
+    turnId: Optional[str] = None  # Unique ID of the turn, used for idempotent writes
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     user: str = ""  # User message text
     assistant: str = ""  # Assistant response text
@@ -3,21 +3,22 @@ Chat API endpoints for managing chats and conversations
 """
 
 import os
+import json
 import tempfile
 import asyncio
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from utils import ChatUtils, UserUtils
-from utils.chroma_utils import ChromaUtils
-from services.langchain_chatbot_service import get_langchain_chatbot_service
+from utils.chroma_utils import get_chroma_utils
+from services.langchain_chatbot_service import get_langchain_chatbot_service, TurnInProgressError
 import logging
 
 # Create a Blueprint for chat routes
 chat_apis = Blueprint('chat_apis', __name__)
 logger = logging.getLogger(__name__)
 
-# Initialize ChromaUtils
-chroma_utils = ChromaUtils()
+# Shared ChromaUtils instance
+chroma_utils = get_chroma_utils()
 
 # Allowed file extensions for document upload
 ALLOWED_EXTENSIONS = {'pdf', 'txt', 'doc', 'docx'}
@@ -27,6 +28,43 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def parse_prompt_request(chat_id):
+    """
+    Validate the body of a prompt request and verify the chat exists
+    
+    Returns:
+        Tuple of ((user_prompt, user_id, turn_id), None) if valid,
+        or (None, (error_response, status_code)) otherwise
+    """
+    data = request.get_json()
+    
+    if not data:
+        return None, (jsonify({'error': 'No data provided'}), 400)
+    
+    # Validate required fields
+    if 'prompt' not in data:
+        return None, (jsonify({'error': 'Prompt is required'}), 400)
+    
+    user_prompt = data['prompt'].strip()
+    if not user_prompt:
+        return None, (jsonify({'error': 'Prompt cannot be empty'}), 400)
+    
+    # Get optional user_id for additional validation
+    user_id = data.get('userId')
+    
+    # Optional client-supplied turn ID, so a retried request is not recorded twice
+    turn_id = data.get('turnId')
+    if turn_id is not None and (not isinstance(turn_id, str) or not turn_id.strip()):
+        return None, (jsonify({'error': 'turnId must be a non-empty string'}), 400)
+    
+    # Verify chat exists
+    chat = ChatUtils.get_chat(chat_id, history_limit=0)
+    if not chat:
+        return None, (jsonify({'error': 'Chat not found'}), 404)
+    
+    return (user_prompt, user_id, turn_id), None
+
+
 @chat_apis.route('/chats', methods=['POST'])
 def create_chat():
     """Create a new chat for a user (userId in request body) and corresponding vector database"""
@@ -91,26 +129,10 @@ def create_chat():
 def add_prompt_to_chat(chat_id):
     """Add a user prompt to chat and process it with RAG + LLM"""
     try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({'error': 'No data provided'}), 400
-        
-        # Validate required fields
-        if 'prompt' not in data:
-            return jsonify({'error': 'Prompt is required'}), 400
-        
-        user_prompt = data['prompt'].strip()
-        if not user_prompt:
-            return jsonify({'error': 'Prompt cannot be empty'}), 400
-        
-        # Get optional user_id for additional validation
-        user_id = data.get('userId')
-        
-        # Verify chat exists
-        chat = ChatUtils.get_chat(chat_id)
-        if not chat:
-            return jsonify({'error': 'Chat not found'}), 404
+        prompt_request, error_response = parse_prompt_request(chat_id)
+        if error_response:
+            return error_response
+        user_prompt, user_id, turn_id = prompt_request
         
         # Process prompt with LangChain chatbot service (RAG + LLM workflow)
         try:
@@ -122,7 +144,7 @@ def add_prompt_to_chat(chat_id):
             
             try:
                 response_data = loop.run_until_complete(
-                    chatbot_service.process_chat_prompt(chat_id, user_prompt, user_id)
+                    chatbot_service.process_chat_prompt(chat_id, user_prompt, user_id, turn_id)
                 )
                 
                 return jsonify({
@@ -139,12 +161,15 @@ def add_prompt_to_chat(chat_id):
             finally:
                 loop.close()
                 
+        except TurnInProgressError as in_progress:
+            return jsonify({'error': str(in_progress)}), 409
+            
         except Exception as chatbot_error:
             logger.error(f"[ChatAPI] Chatbot service error: {chatbot_error}")
             
             # Fallback to basic prompt addition without RAG
             logger.info("[ChatAPI] Falling back to basic prompt addition")
-            success = ChatUtils.add_prompt_to_chat(chat_id, user_prompt)
+            success = ChatUtils.add_prompt_to_chat(chat_id, user_prompt, turn_id=turn_id)
             
             if success:
                 return jsonify({
@@ -166,6 +191,49 @@ def add_prompt_to_chat(chat_id):
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@chat_apis.route('/chats/<chat_id>/prompt/stream', methods=['POST'])
+def stream_prompt_to_chat(chat_id):
+    """Add a user prompt to chat and stream the RAG + LLM response as Server-Sent Events"""
+    try:
+        prompt_request, error_response = parse_prompt_request(chat_id)
+        if error_response:
+            return error_response
+        user_prompt, user_id, turn_id = prompt_request
+        
+        chatbot_service = get_langchain_chatbot_service()
+        
+        def generate():
+            # Drive the async stream on a dedicated event loop for this request
+            loop = asyncio.new_event_loop()
+            stream_result = {}
+            stream = chatbot_service.process_chat_prompt_stream(chat_id, user_prompt, user_id, turn_id, stream_result)
+            
+            try:
+                while True:
+                    try:
+                        chunk = loop.run_until_complete(stream.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    yield f"data: {json.dumps({'token': chunk})}\n\n"
+                
+                done_data = {'chat_id': chat_id, 'citations': stream_result.get('citations', [])}
+                yield f"event: done\ndata: {json.dumps(done_data)}\n\n"
+                
+            except Exception as stream_error:
+                logger.error(f"[ChatAPI] Error streaming prompt for chat {chat_id}: {stream_error}")
+                yield f"event: error\ndata: {json.dumps({'error': str(stream_error)})}\n\n"
+                
+            finally:
+                loop.run_until_complete(stream.aclose())
+                loop.close()
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        
+    except Exception as e:
+        logger.error(f"[ChatAPI] Error streaming prompt: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 @chat_apis.route('/chats/<chat_id>/response', methods=['POST'])
 def add_assistant_response(chat_id):
     """Add assistant response to the latest conversation entry in chat"""
@@ -187,7 +255,7 @@ def add_assistant_response(chat_id):
         citations = data.get('citations', [])
         
         # Verify chat exists
-        chat = ChatUtils.get_chat(chat_id)
+        chat = ChatUtils.get_chat(chat_id, history_limit=1)
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
@@ -237,7 +305,7 @@ def delete_chat(chat_id):
     """Delete a chat"""
     try:
         # Verify chat exists
-        chat = ChatUtils.get_chat(chat_id)
+        chat = ChatUtils.get_chat(chat_id, history_limit=0)
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
@@ -245,6 +313,12 @@ def delete_chat(chat_id):
         success = ChatUtils.delete_chat(chat_id)
         
         if success:
+            # Drop cached retrievals and responses for this chat
+            try:
+                get_langchain_chatbot_service().invalidate_chat(chat_id)
+            except Exception as cache_error:
+                logger.warning(f"[ChatAPI] Failed to invalidate chatbot caches for chat {chat_id}: {cache_error}")
+            
             # Also delete the vector database for this chat
             vector_delete_result = chroma_utils.delete_chat_vector_db(chat_id)
             if not vector_delete_result['success']:
@@ -281,7 +355,7 @@ def upload_document_to_chat(chat_id):
     """Upload a document to a specific chat's vector database"""
     try:
         # Verify chat exists
-        chat = ChatUtils.get_chat(chat_id)
+        chat = ChatUtils.get_chat(chat_id, history_limit=0)
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
@@ -330,6 +404,12 @@ def upload_document_to_chat(chat_id):
             os.unlink(temp_file_path)
             
             if upload_result['success']:
+                # New document invalidates cached retrievals and responses for this chat
+                try:
+                    get_langchain_chatbot_service().invalidate_chat(chat_id)
+                except Exception as cache_error:
+                    logger.warning(f"[ChatAPI] Failed to invalidate chatbot caches for chat {chat_id}: {cache_error}")
+                
                 return jsonify({
                     'message': 'Document uploaded and processed successfully',
                     'chat_id': chat_id,
@@ -382,7 +462,7 @@ def query_chat_documents(chat_id):
             return jsonify({'error': 'n_results must be an integer between 1 and 20'}), 400
         
         # Verify chat exists
-        chat = ChatUtils.get_chat(chat_id)
+        chat = ChatUtils.get_chat(chat_id, history_limit=0)
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
@@ -415,7 +495,7 @@ def get_chat_documents_info(chat_id):
     """Get information about all documents in a chat"""
     try:
         # Verify chat exists
-        chat = ChatUtils.get_chat(chat_id)
+        chat = ChatUtils.get_chat(chat_id, history_limit=0)
         if not chat:
             return jsonify({'error': 'Chat not found'}), 404
         
@@ -477,6 +557,7 @@ def chat_health_check():
         'endpoints': [
             'POST /chats - Create chat with vector database (userId in body)',
             'POST /chats/{chat_id}/prompt - Add prompt with RAG processing',
+            'POST /chats/{chat_id}/prompt/stream - Add prompt with streamed RAG response (SSE)',
             'POST /chats/{chat_id}/response - Add assistant response',
             'GET /chats/{chat_id} - Get chat',
             'DELETE /chats/{chat_id} - Delete chat',
@@ -502,9 +583,14 @@ def chat_health_check():
 def chatbot_health_check():
     """Health check for LangChain chatbot service components"""
     try:
-        from services.langchain_chatbot_service import get_langchain_chatbot_service
+        from services.langchain_chatbot_service import get_langchain_chatbot_service, TurnInProgressError
         chatbot_service = get_langchain_chatbot_service()
-        health_status = chatbot_service.health_check()
+        
+        loop = asyncio.new_event_loop()
+        try:
+            health_status = loop.run_until_complete(chatbot_service.health_check())
+        finally:
+            loop.close()
         
         # Determine overall health
         overall_healthy = all([
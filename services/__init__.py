@@ -3,6 +3,11 @@ Services package for CogniScript RAG Server
 Provides high-level orchestration services
 """
 
-from .langchain_chatbot_service import LangChainChatbotService, get_langchain_chatbot_service
+from .langchain_chatbot_service import (
+    LangChainChatbotService,
+    TurnInProgressError,
+    get_langchain_chatbot_service,
+    warmup_langchain_chatbot_service
+)
 
-__all__ = ['LangChainChatbotService', 'get_langchain_chatbot_service']
\ No newline at end of file
+__all__ = ['LangChainChatbotService', 'TurnInProgressError', 'get_langchain_chatbot_service', 'warmup_langchain_chatbot_service']
\ No newline at end of file
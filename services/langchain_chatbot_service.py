@@ -4,10 +4,20 @@ Integrates RAG with message history management and multiple LLM provider support
 """
 
 import os
+import asyncio
+import functools
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional
-from datetime import datetime
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Callable, AsyncIterator
+from datetime import datetime, timezone
+from io import StringIO
 from dotenv import load_dotenv
+from cachetools import TTLCache
+import pymongo
 
 # LangChain imports - modern architecture with conditional imports
 try:
@@ -40,16 +50,26 @@ from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
-from utils.chroma_utils import ChromaUtils
+from utils.chroma_utils import get_chroma_utils
 from utils.chat_utils import ChatUtils
 from utils.user_utils import UserUtils
 from utils.llm_context_utils import LLMContextFormatter
+from config.mongodb import get_mongodb_client
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
 
+class TurnInProgressError(Exception):
+    """Raised when a retried turn ID is still being answered by an earlier request"""
+
+
+def _now_iso() -> str:
+    """Current UTC time as an ISO 8601 string with millisecond precision"""
+    return datetime.fromtimestamp(time.time(), tz=timezone.utc).isoformat(timespec='milliseconds')
+
+
 class LangChainChatbotService:
     """Enhanced chatbot service using LangChain for conversation management"""
     
@@ -71,11 +91,25 @@ class LangChainChatbotService:
         "Perplexity": "sonar"  # Updated to correct Perplexity model name
     }
     
+    SYSTEM_PROMPT = "You are a helpful AI assistant with access to relevant context. Use the provided context to answer questions accurately. If the context doesn't contain relevant information, say so clearly."
+    
+    # Static prompt scaffolding, built once (only the placeholders change per turn)
+    SYSTEM_TEMPLATE = SYSTEM_PROMPT + "\n\nContext from uploaded documents:\n{context}"
+    CONTEXT_ITEM_TEMPLATE = "Document: {document}\n{text}"
+    NO_CONTEXT_TEXT = "No relevant context was found in the uploaded documents."
+    
+    # Separator between context chunks (kept fixed so the prompt prefix is stable)
+    CONTEXT_SEPARATOR = "\n\n---\n\n"
+    
+    # Stored when a turn fails; a retry of such a turn is answered again
+    ERROR_RESPONSE = "I apologize, but I encountered an error while processing your request. Please try again."
+    FALLBACK_RESPONSE = "I apologize, but I'm having trouble accessing my language model right now. Please try again later."
+    
     def __init__(self):
         """Initialize the chatbot service with modern LangChain components"""
         try:
-            # Initialize ChromaDB and utility classes
-            self.chroma_utils = ChromaUtils()
+            # Initialize ChromaDB (shared client) and utility classes
+            self.chroma_utils = get_chroma_utils()
             self.chat_utils = ChatUtils()
             self.user_utils = UserUtils()
             self.context_formatter = LLMContextFormatter()
@@ -83,13 +117,70 @@ class LangChainChatbotService:
             # Configuration from environment
             self.max_rag_results = int(os.getenv("MAX_RAG_RESULTS", 5))
             self.max_tokens = int(os.getenv("MAX_CONTEXT_TOKENS", 8000))
+            self.max_chat_history = int(os.getenv("MAX_CHAT_HISTORY", 10))
+            self.rag_query_expansion = os.getenv("RAG_QUERY_EXPANSION", "false").lower() == "true"
             
             # Store message histories per chat_id (modern approach)
             self._message_histories: Dict[str, BaseChatMessageHistory] = {}
             
+            # Chats whose message history has already been loaded from MongoDB in this process
+            self._seeded_chats: set = set()
+            
+            # Reuse LLM clients (and their HTTP sessions) per configuration
+            self._llm_instances: Dict[tuple, BaseLanguageModel] = {}
+            
+            # Response and RAG caches keyed by "<chat_id>:<sha256>"
+            self._response_cache = TTLCache(
+                maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", 1024)),
+                ttl=int(os.getenv("RESPONSE_CACHE_TTL", 3600))
+            )
+            self._rag_cache = TTLCache(
+                maxsize=int(os.getenv("RAG_CACHE_SIZE", 1024)),
+                ttl=int(os.getenv("RAG_CACHE_TTL", 600))
+            )
+            self._cache_lock = threading.Lock()
+            
+            # Cached health check result as (monotonic timestamp, result)
+            self._health_cache: Optional[tuple] = None
+            self._health_lock = threading.Lock()
+            self.health_cache_ttl = float(os.getenv("HEALTH_CACHE_TTL", 5))
+            self.health_probe_timeout = float(os.getenv("HEALTH_PROBE_TIMEOUT", 0.5))
+            
+            # Last retrieved context per chat for the cache-augmented (CAG) fast path
+            self._last_contexts: Dict[str, Dict[str, Any]] = {}
+            
+            # Bounded pool for blocking MongoDB/ChromaDB calls made from async methods
+            # Sized (cores * 2) + 1, matching the MongoDB connection pool
+            self._io_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("IO_POOL_SIZE", (os.cpu_count() or 1) * 2 + 1)),
+                thread_name_prefix="cb-io"
+            )
+            
+            # Separate, larger pool for blocking LLM calls, which take seconds each;
+            # keeps them from capping LLM concurrency or queueing DB calls behind them
+            self._llm_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("LLM_POOL_SIZE", 32)),
+                thread_name_prefix="cb-llm"
+            )
+            
+            # Dedicated pool for background MongoDB writes (see _finalize_turn), so they are
+            # never queued behind request-path calls
+            self._write_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("WRITE_POOL_SIZE", 4)),
+                thread_name_prefix="cb-write"
+            )
+            
+            # Small dedicated pool for health probes, so a busy I/O pool cannot time them out
+            self._health_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="cb-health")
+            # In-flight probe per component; a probe still running after its timeout is
+            # awaited again instead of resubmitted, so a hung probe holds at most one worker
+            self._health_futures: Dict[str, Any] = {}
+            
             # Create prompt template for RAG conversations
+            # Ordered static system prompt -> RAG context -> history -> user query so the
+            # prefix stays byte-identical across turns for provider-side prompt caching
             self._prompt_template = ChatPromptTemplate.from_messages([
-                ("system", "You are a helpful AI assistant with access to relevant context. Use the provided context to answer questions accurately. If the context doesn't contain relevant information, say so clearly."),
+                ("system", self.SYSTEM_TEMPLATE),
                 MessagesPlaceholder(variable_name="chat_history"),
                 ("human", "{input}")
             ])
@@ -100,6 +191,20 @@ class LangChainChatbotService:
             logger.error(f"[LangChainChatbotService] Failed to initialize: {e}")
             raise
     
+    async def _run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking call on the I/O thread pool without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_pool, functools.partial(fn, *args, **kwargs))
+    
+    async def _run_llm(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking LLM call on the LLM thread pool without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._llm_pool, functools.partial(fn, *args, **kwargs))
+    
     def _create_llm(self, 
                    provider: Optional[str] = None,
                    model: Optional[str] = None,
@@ -124,6 +229,11 @@ class LangChainChatbotService:
         # Get model name
         model = model or self.DEFAULT_MODELS.get(provider)
         
+        # Return the existing client for this configuration if available
+        llm_key = (provider, model, temperature, max_tokens)
+        if llm_key in self._llm_instances:
+            return self._llm_instances[llm_key]
+        
         # Create LLM instance based on provider
         try:
             llm_class = self.PROVIDERS[provider]
@@ -164,6 +274,7 @@ class LangChainChatbotService:
                     max_tokens=max_tokens
                 )
             
+            self._llm_instances[llm_key] = llm
             logger.info(f"[LangChainChatbotService] Created {provider} LLM with model: {model}")
             return llm
             
@@ -181,6 +292,35 @@ class LangChainChatbotService:
         
         return self._message_histories[chat_id]
     
+    def _seed_message_history(self, chat_id: str, conversation_history: List[Dict[str, Any]]) -> None:
+        """
+        Load stored conversation history into the message history the first time a chat
+        is seen by this process (e.g. after a server restart), so the LLM keeps context
+        from earlier turns
+        
+        Args:
+            chat_id: Chat session ID
+            conversation_history: Recent conversation entries from MongoDB
+        """
+        if chat_id in self._seeded_chats:
+            return
+        self._seeded_chats.add(chat_id)
+        
+        message_history = self._get_message_history(chat_id)
+        if message_history.messages:
+            return
+        
+        # Only complete user/assistant pairs are kept, so the just-added prompt is skipped
+        formatted_history = self.context_formatter.format_chat_history(conversation_history, self.max_chat_history)
+        if not formatted_history:
+            return
+        
+        message_history.add_messages([
+            HumanMessage(content=msg["content"]) if msg["role"] == "user" else AIMessage(content=msg["content"])
+            for msg in formatted_history
+        ])
+        logger.info(f"[LangChainChatbotService] Seeded {len(formatted_history)} history messages for chat_id: {chat_id}")
+    
     def _create_conversation_runnable(self, llm: Optional[BaseLanguageModel] = None):
         """
         Create a modern LangChain runnable with message history
@@ -220,7 +360,8 @@ class LangChainChatbotService:
         
         return self._conversation_runnable
     
-    async def process_chat_prompt(self, chat_id: str, user_prompt: str, user_id: str = None) -> Dict[str, Any]:
+    async def process_chat_prompt(self, chat_id: str, user_prompt: str, user_id: str = None,
+                                  turn_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Process a chat prompt with RAG workflow and LangChain memory management
         
@@ -228,6 +369,7 @@ class LangChainChatbotService:
             chat_id: Chat session ID
             user_prompt: User's input prompt
             user_id: Optional user ID for validation
+            turn_id: Optional client-supplied turn ID (generated if not given)
             
         Returns:
             Dictionary containing response and metadata
@@ -235,106 +377,428 @@ class LangChainChatbotService:
         try:
             logger.info(f"[LangChainChatbotService] Processing prompt for chat_id: {chat_id}")
             
-            # Step 1: Validate chat and user
-            chat = self.chat_utils.get_chat(chat_id)
-            if not chat:
-                raise ValueError(f"Chat not found: {chat_id}")
-            
-            if user_id and chat.get('userId') != user_id:
-                raise ValueError("User ID does not match chat owner")
-            
-            # Step 2: Add user prompt to MongoDB chat history
-            self.chat_utils.add_prompt_to_chat(chat_id, user_prompt)
-            
-            # Step 3: Perform RAG retrieval
-            rag_results = await self._retrieve_relevant_context(chat_id, user_prompt)
-            formatted_rag_context = self.context_formatter.format_rag_context(rag_results)
-            
-            # Step 4: Get conversation runnable
-            conversation_runnable = self._get_or_create_conversation()
-            
-            # Step 5: Prepare prompt with RAG context
-            final_prompt = self._prepare_final_prompt(user_prompt, formatted_rag_context)
+            # Steps 1-5: Validate, store prompt, retrieve and prepare RAG context
+            turn = await self._prepare_turn(chat_id, user_prompt, user_id, turn_id)
+            if turn["stored_turn"] is not None:
+                return self._serve_stored_turn(chat_id, turn["stored_turn"])
+            if turn["cached_response"] is not None:
+                return await self._serve_cached_response(chat_id, user_prompt, turn["cached_response"], turn["turn_id"])
             
             # Step 6: Generate response using modern LangChain runnable
-            response_data = await self._generate_langchain_response(conversation_runnable, chat_id, final_prompt)
-            
-            # Step 7: Extract citations from RAG context
-            citations = self.context_formatter.extract_citations_from_context(
-                formatted_rag_context,
-                response_data["response"]
+            response_data = await self._generate_langchain_response(
+                turn["conversation_runnable"], chat_id, user_prompt, turn["context_text"]
             )
             
-            # Step 8: Store assistant response in MongoDB
-            self.chat_utils.add_assistant_response_to_chat(
-                chat_id,
-                response_data["response"],
-                citations
-            )
+            # Steps 7-8: Extract citations and store assistant response (in the background)
+            citations = self._finalize_turn(chat_id, turn, response_data)
             
             # Step 9: Prepare final response
             final_response = {
                 "chatId": chat_id,
                 "response": response_data["response"],
                 "citations": citations,
-                "contextUsed": len(formatted_rag_context),
+                "contextUsed": len(turn["rag_context"]),
                 "historyUsed": response_data.get("history_messages_count", 0),
                 "memorySummaryUsed": response_data.get("has_summary", False),
                 "llmProvider": os.getenv("LLM_PROVIDER", "Unknown"),
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": _now_iso()
             }
             
             logger.info(f"[LangChainChatbotService] Successfully processed prompt for chat_id: {chat_id}")
             return final_response
             
+        except TurnInProgressError:
+            raise
         except Exception as e:
             logger.error(f"[LangChainChatbotService] Error processing prompt: {e}")
+            await self._store_error_response(chat_id, turn_id)
+            raise
+    
+    async def process_chat_prompt_stream(self, chat_id: str, user_prompt: str,
+                                         user_id: str = None,
+                                         turn_id: Optional[str] = None,
+                                         result: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Process a chat prompt like process_chat_prompt, but yield the response
+        text as it is generated by the LLM
+        
+        Citation extraction and storing the assistant response run once the
+        stream has finished.
+        
+        Args:
+            chat_id: Chat session ID
+            user_prompt: User's input prompt
+            user_id: Optional user ID for validation
+            turn_id: Optional client-supplied turn ID (generated if not given)
+            result: Optional dict that receives the turn's "citations" once the stream has finished
             
-            # Try to add error response to chat
-            try:
-                error_response = "I apologize, but I encountered an error while processing your request. Please try again."
-                self.chat_utils.add_assistant_response_to_chat(chat_id, error_response, [])
-            except:
-                pass  # Don't fail if we can't add error response
+        Yields:
+            Response text chunks
+        """
+        if result is None:
+            result = {}
+        
+        try:
+            logger.info(f"[LangChainChatbotService] Streaming prompt for chat_id: {chat_id}")
+            
+            # Steps 1-5: Validate, store prompt, retrieve and prepare RAG context
+            turn = await self._prepare_turn(chat_id, user_prompt, user_id, turn_id)
+            if turn["stored_turn"] is not None:
+                stored = self._serve_stored_turn(chat_id, turn["stored_turn"])
+                result["citations"] = stored["citations"]
+                yield stored["response"]
+                return
+            if turn["cached_response"] is not None:
+                cached = await self._serve_cached_response(chat_id, user_prompt, turn["cached_response"], turn["turn_id"])
+                result["citations"] = cached["citations"]
+                yield cached["response"]
+                return
+            
+            # Step 6: Stream response from the LangChain runnable
+            buffer = StringIO()
+            async for chunk in turn["conversation_runnable"].astream(
+                {"input": user_prompt, "context": turn["context_text"]},
+                config={"configurable": {"session_id": chat_id}}
+            ):
+                text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if text:
+                    buffer.write(text)
+                    yield text
             
+            response_data = {
+                "response": buffer.getvalue(),
+                "history_messages_count": len(self._get_message_history(chat_id).messages),
+                "has_summary": False
+            }
+            
+            # Steps 7-8: Extract citations and store assistant response (in the background)
+            result["citations"] = self._finalize_turn(chat_id, turn, response_data)
+            
+            logger.info(f"[LangChainChatbotService] Successfully streamed prompt for chat_id: {chat_id}")
+            
+        except TurnInProgressError:
             raise
+        except Exception as e:
+            logger.error(f"[LangChainChatbotService] Error streaming prompt: {e}")
+            await self._store_error_response(chat_id, turn_id)
+            raise
+    
+    async def _prepare_turn(self, chat_id: str, user_prompt: str, user_id: str = None,
+                            turn_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Run the steps shared by the regular and streaming prompt workflows:
+        validate the chat, store the prompt, retrieve and prepare the RAG context
+        
+        Args:
+            chat_id: Chat session ID
+            user_prompt: User's input prompt
+            user_id: Optional user ID for validation
+            turn_id: Optional client-supplied turn ID (generated if not given)
+            
+        Returns:
+            Dictionary with the cached response (if any), RAG context, context text,
+            conversation runnable and response cache key
+        """
+        # Step 1: Validate chat and user (history is not needed here; matches the route's cached lookup)
+        chat = await self._run(self.chat_utils.get_chat, chat_id, 0)
+        if not chat:
+            raise ValueError(f"Chat not found: {chat_id}")
+        
+        if user_id and chat.get('userId') != user_id:
+            raise ValueError("User ID does not match chat owner")
+        
+        turn = {
+            "turn_id": turn_id or str(uuid.uuid4()),
+            "response_cache_key": self._response_cache_key(chat_id, user_prompt),
+            "cached_response": None,
+            "stored_turn": None,
+            "rag_context": [],
+            "context_text": "",
+            "conversation_runnable": None
+        }
+        
+        # Return a cached response if the same prompt was answered at this point of the conversation
+        turn["cached_response"] = self._cache_get(self._response_cache, turn["response_cache_key"])
+        if turn["cached_response"] is not None:
+            return turn
+        
+        # Step 2 & 3: Add user prompt to MongoDB chat history and perform RAG retrieval concurrently
+        # (the Chroma query does not depend on the appended prompt)
+        updated_chat, rag_results = await asyncio.gather(
+            self._run(self.chat_utils.add_prompt_to_chat, chat_id, user_prompt, self.max_chat_history, turn["turn_id"]),
+            self._retrieve_relevant_context(chat_id, user_prompt, self._get_query_expansions(chat_id, user_prompt))
+        )
+        if updated_chat:
+            self._seed_message_history(chat_id, updated_chat.get('conversation_history', []))
+        else:
+            # A retried turn_id whose prompt is already recorded is answered from MongoDB,
+            # unless the earlier attempt failed
+            stored_turn = await self._run(self.chat_utils.get_turn, chat_id, turn_id) if turn_id else None
+            if stored_turn is None:
+                logger.warning(f"[LangChainChatbotService] Failed to store prompt for chat_id: {chat_id}")
+            elif stored_turn.get("assistant") not in (self.ERROR_RESPONSE, self.FALLBACK_RESPONSE):
+                turn["stored_turn"] = stored_turn
+                return turn
+        
+        # Step 4: Get conversation runnable
+        turn["conversation_runnable"] = self._get_or_create_conversation()
+        
+        # Step 5: Prepare canonical RAG context and its text for the system prompt
+        turn["rag_context"], turn["context_text"] = self._prepare_context(chat_id, rag_results)
+        
+        return turn
     
-    def _prepare_final_prompt(self, user_prompt: str, rag_context: List[Dict[str, str]]) -> str:
+    def _finalize_turn(self, chat_id: str, turn: Dict[str, Any],
+                       response_data: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
-        Prepare the final prompt that includes RAG context
+        Extract citations, cache the turn and store the assistant response in the background
+        
+        The MongoDB write is not awaited, so the response can be returned as soon as
+        it is generated.
         
         Args:
-            user_prompt: Original user prompt
-            rag_context: Retrieved context from ChromaDB
+            chat_id: Chat session ID
+            turn: Prepared turn data from _prepare_turn
+            response_data: Generated response data
             
         Returns:
-            Final prompt with context integrated
+            List of citations
+        """
+        # Step 7: Extract citations from RAG context
+        citations = self.context_formatter.extract_citations_from_context(
+            turn["rag_context"],
+            response_data["response"]
+        )
+        
+        # Cache successful responses for identical follow-up prompts
+        if not response_data.get("fallback", False):
+            self._cache_set(self._response_cache, turn["response_cache_key"], {
+                "response": response_data["response"],
+                "citations": citations,
+                "contextUsed": len(turn["rag_context"]),
+                "historyUsed": response_data.get("history_messages_count", 0),
+                "memorySummaryUsed": response_data.get("has_summary", False)
+            })
+        
+        # Step 8: Store assistant response in MongoDB (on the entry of this turn) in the background
+        # Submitted to the write pool rather than the event loop, which the routes close per request
+        future = self._write_pool.submit(
+            self.chat_utils.add_assistant_response_to_chat,
+            chat_id,
+            response_data["response"],
+            citations,
+            turn["turn_id"]
+        )
+        future.add_done_callback(functools.partial(self._log_background_write, chat_id))
+        
+        return citations
+    
+    @staticmethod
+    def _log_background_write(chat_id: str, future) -> None:
+        """Log the outcome of a background assistant response write"""
+        if future.exception() is not None:
+            logger.error(f"[LangChainChatbotService] Background response write failed for chat_id {chat_id}: {future.exception()}")
+        elif not future.result():
+            logger.warning(f"[LangChainChatbotService] Background response write did not update chat_id: {chat_id}")
+    
+    async def _store_error_response(self, chat_id: str, turn_id: Optional[str] = None) -> None:
+        """Try to add an error response to the chat after a failed prompt"""
+        try:
+            await self._run(self.chat_utils.add_assistant_response_to_chat, chat_id, self.ERROR_RESPONSE, [], turn_id)
+        except:
+            pass  # Don't fail if we can't add error response
+    
+    async def _serve_cached_response(self, chat_id: str, user_prompt: str, cached_response: Dict[str, Any],
+                                     turn_id: str) -> Dict[str, Any]:
+        """
+        Record a cached turn in MongoDB and build the API response from it
+        
+        Args:
+            chat_id: Chat session ID
+            user_prompt: User's input prompt
+            cached_response: Cached response data
+            turn_id: Unique turn ID
+            
+        Returns:
+            Dictionary containing response and metadata
+        """
+        logger.info(f"[LangChainChatbotService] Serving cached response for chat_id: {chat_id}")
+        
+        # Prompt and response are both known, so record the turn in a single write
+        recorded = await self._run(
+            self.chat_utils.append_turn,
+            chat_id,
+            user_prompt,
+            cached_response["response"],
+            cached_response["citations"],
+            turn_id
+        )
+        
+        # Keep the in-memory conversation in step with MongoDB (nothing is written for a retried turn)
+        if recorded:
+            message_history = self._get_message_history(chat_id)
+            message_history.add_message(HumanMessage(content=user_prompt))
+            message_history.add_message(AIMessage(content=cached_response["response"]))
+        
+        return {
+            "chatId": chat_id,
+            **cached_response,
+            "cached": True,
+            "llmProvider": os.getenv("LLM_PROVIDER", "Unknown"),
+            "timestamp": _now_iso()
+        }
+    
+    def _serve_stored_turn(self, chat_id: str, stored_turn: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the API response for a retried turn from its entry in MongoDB
+        
+        Args:
+            chat_id: Chat session ID
+            stored_turn: Conversation entry recorded by an earlier attempt
+            
+        Returns:
+            Dictionary containing response and metadata
+        """
+        if not stored_turn.get("assistant"):
+            raise TurnInProgressError(f"Turn {stored_turn.get('turnId')} is still being processed")
+        
+        logger.info(f"[LangChainChatbotService] Serving stored turn {stored_turn.get('turnId')} for chat_id: {chat_id}")
+        
+        return {
+            "chatId": chat_id,
+            "response": stored_turn["assistant"],
+            "citations": stored_turn.get("citations", []),
+            "contextUsed": 0,
+            "historyUsed": len(self._get_message_history(chat_id).messages),
+            "memorySummaryUsed": False,
+            "cached": True,
+            "llmProvider": os.getenv("LLM_PROVIDER", "Unknown"),
+            "timestamp": _now_iso()
+        }
+    
+    @staticmethod
+    def _cache_key(chat_id: str, *parts: str) -> str:
+        """
+        Build a cache key prefixed with chat_id so a chat's entries can be invalidated together
+        """
+        digest = hashlib.sha256("|".join((chat_id, *parts)).encode("utf-8")).hexdigest()
+        return f"{chat_id}:{digest}"
+    
+    def _response_cache_key(self, chat_id: str, user_prompt: str) -> str:
+        """
+        Build the response cache key from the normalized prompt and the recent history
+        preceding the turn being answered, so that a new turn in the conversation
+        invalidates earlier entries while a re-asked prompt still hits
+        """
+        normalized_prompt = " ".join(user_prompt.lower().split())
+        messages = self._get_message_history(chat_id).messages
+        
+        # A retry of the last prompt is keyed on the history before its first answer
+        if (len(messages) >= 2 and isinstance(messages[-2], HumanMessage) and isinstance(messages[-1], AIMessage)
+                and " ".join(str(messages[-2].content).lower().split()) == normalized_prompt):
+            messages = messages[:-2]
+        
+        recent_messages = messages[-3:]
+        history_head = hashlib.sha256(
+            str([(message.type, message.content) for message in recent_messages]).encode("utf-8")
+        ).hexdigest()
+        return self._cache_key(chat_id, normalized_prompt, history_head)
+    
+    def _cache_get(self, cache: TTLCache, key: str) -> Optional[Any]:
+        """Thread-safe cache lookup"""
+        with self._cache_lock:
+            return cache.get(key)
+    
+    def _cache_set(self, cache: TTLCache, key: str, value: Any) -> None:
+        """Thread-safe cache insert"""
+        with self._cache_lock:
+            cache[key] = value
+    
+    def invalidate_chat(self, chat_id: str) -> None:
+        """
+        Drop all cached RAG results and responses for a chat
+        (e.g. after a document upload or chat deletion)
+        
+        Args:
+            chat_id: Chat session ID
+        """
+        prefix = f"{chat_id}:"
+        with self._cache_lock:
+            for cache in (self._response_cache, self._rag_cache):
+                for key in [key for key in cache.keys() if key.startswith(prefix)]:
+                    cache.pop(key, None)
+            self._last_contexts.pop(chat_id, None)
+        logger.info(f"[LangChainChatbotService] Invalidated caches for chat_id: {chat_id}")
+    
+    def _prepare_context(self, chat_id: str, rag_results: Dict[str, Any]) -> tuple:
+        """
+        Format retrieved results into RAG context and context text, reusing the
+        previous turn's prepared context when the retrieval results are unchanged
+        
+        Args:
+            chat_id: Chat session ID
+            rag_results: ChromaDB query results
+            
+        Returns:
+            Tuple of (rag_context, context_text)
+        """
+        with self._cache_lock:
+            last_context = self._last_contexts.get(chat_id)
+        is_last_results = last_context is not None and last_context["results"] is rag_results
+        
+        if is_last_results and "context_text" in last_context:
+            return last_context["rag_context"], last_context["context_text"]
+        
+        # Apply the MAX_CONTEXT_TOKENS budget in relevance order, before the stable reordering
+        # (no history is passed, so the context may use the whole budget)
+        relevant_chunks = rag_results.get('relevant_chunks', []) if rag_results else []
+        kept_chunks, _ = self.context_formatter.truncate_context_if_needed(relevant_chunks, [], self.max_tokens)
+        if len(kept_chunks) < len(relevant_chunks):
+            rag_results = {**rag_results, 'relevant_chunks': kept_chunks}
+        
+        rag_context = self.context_formatter.format_rag_context(rag_results, stable_order=True)
+        context_text = self._prepare_context_text(rag_context)
+        
+        if is_last_results:
+            with self._cache_lock:
+                last_context["rag_context"] = rag_context
+                last_context["context_text"] = context_text
+        
+        return rag_context, context_text
+    
+    def _prepare_context_text(self, rag_context: List[Dict[str, str]]) -> str:
+        """
+        Prepare the RAG context text placed in the system prompt
+        
+        The context is kept out of the user message so that message history only
+        stores the raw prompts, and it is joined with a fixed separator so that
+        the same chunks always produce byte-identical text.
+        
+        Args:
+            rag_context: Formatted RAG context (in stable order)
+            
+        Returns:
+            Context text for the prompt template
         """
         if not rag_context:
-            return user_prompt
+            return self.NO_CONTEXT_TEXT
         
-        # Format context for inclusion in prompt
-        context_text = "\\n\\n".join([
-            f"Document: {ctx.get('filename', 'Unknown')}\\n{ctx.get('text', '')}"
+        item_template = self.CONTEXT_ITEM_TEMPLATE
+        return self.CONTEXT_SEPARATOR.join([
+            item_template.format(document=ctx.get('document', 'Unknown'), text=ctx.get('text', ''))
             for ctx in rag_context
         ])
-        
-        # Include context in the user message
-        final_prompt = f"""Context from uploaded documents:
-{context_text}
-
-Question: {user_prompt}"""
-        
-        return final_prompt
     
-    async def _generate_langchain_response(self, conversation_runnable, chat_id: str, user_input: str) -> Dict[str, Any]:
+    async def _generate_langchain_response(self, conversation_runnable, chat_id: str, user_input: str,
+                                           context_text: str) -> Dict[str, Any]:
         """
         Generate response using modern LangChain runnable with message history
         
         Args:
             conversation_runnable: LangChain runnable with message history
             chat_id: Chat session ID for message history
-            user_input: User input with RAG context
+            user_input: User's input prompt
+            context_text: RAG context text for the system prompt
             
         Returns:
             Response data with metadata
@@ -344,11 +808,18 @@ Question: {user_prompt}"""
             
             # Invoke the runnable with message history
             # The runnable automatically manages conversation history per chat_id
-            result = conversation_runnable.invoke(
-                {"input": user_input},
+            result = await self._run_llm(
+                conversation_runnable.invoke,
+                {"input": user_input, "context": context_text},
                 config={"configurable": {"session_id": chat_id}}
             )
             
+            # Log prompt cache usage when the provider reports it
+            usage = getattr(result, 'usage_metadata', None) or {}
+            cache_read_tokens = (usage.get('input_token_details') or {}).get('cache_read')
+            if cache_read_tokens is not None:
+                logger.info(f"[LangChainChatbotService] Prompt cache read tokens: {cache_read_tokens}/{usage.get('input_tokens', 0)}")
+            
             # Get message history for metadata
             message_history = self._get_message_history(chat_id)
             history_messages_count = len(message_history.messages)
@@ -369,18 +840,48 @@ Question: {user_prompt}"""
             logger.error(f"[LangChainChatbotService] Error generating LangChain response: {e}")
             # Return fallback response
             return {
-                "response": "I apologize, but I'm having trouble accessing my language model right now. Please try again later.",
+                "response": self.FALLBACK_RESPONSE,
                 "history_messages_count": 0,
-                "has_summary": False
+                "has_summary": False,
+                "fallback": True
             }
     
-    async def _retrieve_relevant_context(self, chat_id: str, query: str) -> Dict[str, Any]:
+    def _get_query_expansions(self, chat_id: str, user_prompt: str) -> List[str]:
+        """
+        Build additional retrieval queries for a prompt
+        
+        Follow-up questions often rely on the previous question for their subject,
+        so the previous user prompt combined with the current one is added as an expansion.
+        Disabled unless RAG_QUERY_EXPANSION is set, since the expansion can pull chunks
+        of the previous topic into the context.
+        
+        Args:
+            chat_id: Chat session ID
+            user_prompt: User's input prompt
+            
+        Returns:
+            List of expansion queries (may be empty)
+        """
+        if not self.rag_query_expansion:
+            return []
+        
+        for message in reversed(self._get_message_history(chat_id).messages):
+            if isinstance(message, HumanMessage) and message.content:
+                return [f"{message.content}\n{user_prompt}"]
+        return []
+    
+    async def _retrieve_relevant_context(self, chat_id: str, query: str,
+                                         expansions: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Retrieve relevant context from ChromaDB
         
+        The query and its expansions are embedded and searched in a single batched
+        ChromaDB request, with results fused by Reciprocal Rank Fusion.
+        
         Args:
             chat_id: Chat session ID
             query: Search query
+            expansions: Optional additional query texts
             
         Returns:
             ChromaDB query results
@@ -388,9 +889,27 @@ Question: {user_prompt}"""
         try:
             logger.info(f"[LangChainChatbotService] Retrieving context for query: {query[:100]}...")
             
-            results = self.chroma_utils.query_chat_docs(chat_id, query, self.max_rag_results)
+            queries = [query, *(expansions or [])]
+            
+            rag_cache_key = self._cache_key(chat_id, *queries)
+            cached_results = self._cache_get(self._rag_cache, rag_cache_key)
+            if cached_results is not None:
+                logger.info(f"[LangChainChatbotService] Using cached context for chat_id: {chat_id}")
+                return cached_results
+            
+            results = await self._run(
+                self.chroma_utils.query_chat_docs_batch, chat_id, queries, self.max_rag_results
+            )
+            
+            # CAG fast path: reuse the previous turn's context if the query brings no new evidence
+            reused_results = self._reuse_last_context(chat_id, results)
+            if reused_results is not None:
+                self._cache_set(self._rag_cache, rag_cache_key, reused_results)
+                return reused_results
             
             if results.get('success'):
+                self._cache_set(self._rag_cache, rag_cache_key, results)
+                self._remember_context(chat_id, results)
                 context_count = len(results.get('relevant_chunks', []))
                 logger.info(f"[LangChainChatbotService] Retrieved {context_count} context items")
             else:
@@ -402,6 +921,53 @@ Question: {user_prompt}"""
             logger.error(f"[LangChainChatbotService] Error retrieving context: {e}")
             return {"success": False, "relevant_chunks": []}
     
+    def _remember_context(self, chat_id: str, results: Dict[str, Any]) -> None:
+        """
+        Store the retrieved context of a chat's latest turn with its fingerprint
+        
+        Args:
+            chat_id: Chat session ID
+            results: Successful ChromaDB query results
+        """
+        chunk_ids = sorted(chunk['chunk_id'] for chunk in results.get('relevant_chunks', []))
+        if not chunk_ids:
+            return
+        
+        with self._cache_lock:
+            self._last_contexts[chat_id] = {
+                "fingerprint": hashlib.sha256("|".join(chunk_ids).encode("utf-8")).hexdigest(),
+                "chunk_ids": set(chunk_ids),
+                "results": results
+            }
+    
+    def _reuse_last_context(self, chat_id: str, results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Reuse the previous turn's context if all chunks of the new retrieval
+        are already part of it
+        
+        Reusing the stored results keeps the context text byte-identical,
+        so provider-side prompt prefix caching applies to the follow-up turn.
+        
+        Args:
+            chat_id: Chat session ID
+            results: ChromaDB query results of the current turn
+            
+        Returns:
+            Previous ChromaDB results if reusable, None otherwise
+        """
+        with self._cache_lock:
+            last_context = self._last_contexts.get(chat_id)
+        if last_context is None or not results.get('success'):
+            return None
+        
+        result_ids = {chunk['chunk_id'] for chunk in results.get('relevant_chunks', [])}
+        
+        if result_ids and result_ids <= last_context["chunk_ids"]:
+            logger.info(f"[LangChainChatbotService] Reusing context {last_context['fingerprint'][:12]} for chat_id: {chat_id}")
+            return last_context["results"]
+        
+        return None
+    
     def clear_conversation_memory(self, chat_id: str) -> bool:
         """
         Clear conversation memory for a specific chat
@@ -413,6 +979,7 @@ Question: {user_prompt}"""
             True if successful
         """
         try:
+            self.invalidate_chat(chat_id)
             if chat_id in self._message_histories:
                 self._message_histories[chat_id].clear()
                 logger.info(f"[LangChainChatbotService] Cleared memory for chat_id: {chat_id}")
@@ -432,6 +999,7 @@ Question: {user_prompt}"""
             True if successful
         """
         try:
+            self.invalidate_chat(chat_id)
             if chat_id in self._message_histories:
                 del self._message_histories[chat_id]
                 logger.info(f"[LangChainChatbotService] Removed conversation history for chat_id: {chat_id}")
@@ -467,13 +1035,20 @@ Question: {user_prompt}"""
             logger.error(f"[LangChainChatbotService] Error getting conversation info: {e}")
             return {"exists": False, "error": str(e)}
     
-    def health_check(self) -> Dict[str, Any]:
+    async def health_check(self) -> Dict[str, Any]:
         """
         Check health of all service components including LangChain
         
+        The ChromaDB, MongoDB and LLM probes run concurrently with a timeout,
+        and the result is cached briefly so frequent health polling stays cheap.
+        
         Returns:
             Health status of each component
         """
+        with self._health_lock:
+            if self._health_cache and time.monotonic() - self._health_cache[0] < self.health_cache_ttl:
+                return self._health_cache[1]
+        
         health = {
             "chatbot_service": True,
             "chroma_db": False,
@@ -481,36 +1056,55 @@ Question: {user_prompt}"""
             "langchain_llm": False,
             "llm_provider": os.getenv("LLM_PROVIDER", "Unknown"),
             "active_conversations": len(self._message_histories),
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": _now_iso()
         }
         
-        try:
-            # Check ChromaDB
-            collection = self.chroma_utils.get_collection()
-            health["chroma_db"] = collection is not None
-        except:
-            pass
+        chroma_ok, mongodb_ok, llm_result = await asyncio.gather(
+            self._probe("chroma_db", self.chroma_utils.chroma_client.heartbeat),
+            self._probe("mongodb", self._ping_mongodb, self.health_probe_timeout),
+            self._probe("langchain_llm", self._create_llm),
+            return_exceptions=True
+        )
         
-        try:
-            # Check MongoDB
-            test_chat = self.chat_utils.get_chat("health_check_test")
-            health["mongodb"] = True
-        except:
-            pass
+        health["chroma_db"] = not isinstance(chroma_ok, Exception)
+        health["mongodb"] = not isinstance(mongodb_ok, Exception)
         
-        try:
-            # Check LangChain LLM
-            llm = self._create_llm()
-            health["langchain_llm"] = llm is not None
+        if isinstance(llm_result, Exception):
+            health["llm_error"] = str(llm_result) or type(llm_result).__name__
+        else:
+            health["langchain_llm"] = llm_result is not None
             health["provider_info"] = {
                 "current_provider": os.getenv("LLM_PROVIDER", "Perplexity"),
                 "available_providers": list(self.PROVIDERS.keys()),
                 "is_configured": bool(os.getenv(f"{os.getenv('LLM_PROVIDER', 'Perplexity').upper()}_API_KEY"))
             }
-        except Exception as e:
-            health["llm_error"] = str(e)
+        
+        with self._health_lock:
+            self._health_cache = (time.monotonic(), health)
         
         return health
+    
+    @staticmethod
+    def _ping_mongodb(timeout: Optional[float] = None) -> Any:
+        """
+        Ping MongoDB through the shared connection pool
+        
+        Args:
+            timeout: Optional limit in seconds for server selection and the ping itself
+        """
+        with pymongo.timeout(timeout):
+            return get_mongodb_client().admin.command("ping")
+    
+    async def _probe(self, name: str, fn: Callable, *args) -> Any:
+        """Run a blocking health probe on the health pool with the probe timeout"""
+        with self._health_lock:
+            future = self._health_futures.get(name)
+            if future is None or future.done():
+                future = self._health_pool.submit(fn, *args)
+                self._health_futures[name] = future
+        
+        # Shielded, so a timeout here does not cancel the probe shared with later checks
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.health_probe_timeout)
 
 
 # Service instance (singleton pattern)
@@ -524,5 +1118,35 @@ def get_langchain_chatbot_service() -> LangChainChatbotService:
     return _langchain_chatbot_service_instance
 
 
+def warmup_langchain_chatbot_service() -> Dict[str, bool]:
+    """
+    Initialize the chatbot service singleton and warm its connections before traffic arrives,
+    so the first requests don't pay for client setup and TLS handshakes
+    
+    Returns:
+        Warmup status of each component
+    """
+    service = get_langchain_chatbot_service()
+    
+    steps = {
+        "chroma_db": service.chroma_utils.chroma_client.heartbeat,
+        "mongodb": LangChainChatbotService._ping_mongodb,
+        "embedder": lambda: service.chroma_utils.embedder.embed_query("warmup"),
+        "langchain_llm": service._get_or_create_conversation
+    }
+    
+    status = {}
+    for name, step in steps.items():
+        try:
+            step()
+            status[name] = True
+        except Exception as e:
+            logger.warning(f"[LangChainChatbotService] Warmup of {name} failed: {e}")
+            status[name] = False
+    
+    logger.info(f"[LangChainChatbotService] Warmup completed: {status}")
+    return status
+
+
 # Default export
-__all__ = ['LangChainChatbotService', 'get_langchain_chatbot_service']
\ No newline at end of file
+__all__ = ['LangChainChatbotService', 'TurnInProgressError', 'get_langchain_chatbot_service', 'warmup_langchain_chatbot_service']
\ No newline at end of file
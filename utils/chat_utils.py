@@ -2,19 +2,45 @@
 Chat utility functions for chat management operations
 """
 
+import threading
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 from bson import ObjectId
+from cachetools import TTLCache
+from pymongo import ReturnDocument
 from models import ChatModel, ConversationEntry, CitationModel
 from config.mongodb import get_mongodb_collection
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Short-lived cache of get_chat results keyed by (chat_id, history_limit), so back-to-back
+# reads within one request hit memory; entries are invalidated on every chat write
+_chat_cache = TTLCache(maxsize=1024, ttl=2)
+_chat_cache_lock = threading.Lock()
+
+# Per-chat invalidation counter; a read only populates the cache if no write
+# invalidated the chat while it was querying MongoDB. Entries expire long after
+# any read can take, and a missing entry counts as 0
+_chat_generations = TTLCache(maxsize=65536, ttl=300)
+
 
 class ChatUtils:
     """Utility class for chat operations"""
     
+    @staticmethod
+    def _invalidate_chat_cache(chat_id: str) -> None:
+        """
+        Drop cached get_chat results for a chat
+        
+        Args:
+            chat_id: Chat ObjectId as string
+        """
+        with _chat_cache_lock:
+            _chat_generations[chat_id] = _chat_generations.get(chat_id, 0) + 1
+            for key in [key for key in list(_chat_cache.keys()) if key[0] == chat_id]:
+                _chat_cache.pop(key, None)
+    
     @staticmethod
     def create_chat(user_id: str, title: Optional[str] = None) -> Optional[str]:
         """
@@ -64,20 +90,48 @@ class ChatUtils:
             return None
     
     @staticmethod
-    def add_prompt_to_chat(chat_id: str, user_prompt: str) -> bool:
+    def _build_citation_models(citations: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Convert citation dictionaries into stored CitationModel dictionaries
+        
+        Args:
+            citations: List of citations as dictionaries
+            
+        Returns:
+            List of citation model dictionaries
+        """
+        citation_models = []
+        if citations:
+            for citation in citations:
+                citation_model = CitationModel(
+                    citationId=str(ObjectId()),
+                    source=citation.get('source', ''),
+                    text=citation.get('text', ''),
+                    page=citation.get('page'),
+                    link=citation.get('link')
+                )
+                citation_models.append(citation_model.dict())
+        return citation_models
+    
+    @staticmethod
+    def add_prompt_to_chat(chat_id: str, user_prompt: str, history_limit: Optional[int] = None,
+                           turn_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Add a user prompt to chat conversation history
         
         Args:
             chat_id: Chat ObjectId as string
             user_prompt: User's message text
+            history_limit: Optional number of most recent history entries to return
+            turn_id: Optional unique turn ID; a retried write with the same ID is not duplicated
             
         Returns:
-            True if successful, False if failed
+            Updated chat document (with the new entry) if successful, None if failed
         """
         try:
             # Create conversation entry with user prompt only
             conversation_entry = ConversationEntry(
+                turnId=turn_id,
                 timestamp=datetime.utcnow(),
                 user=user_prompt,
                 assistant="",  # Empty initially
@@ -85,29 +139,44 @@ class ChatUtils:
                 citations=[]
             )
             
-            # Update chat in MongoDB
+            # Only ship the most recent history entries back if a limit is given
+            projection = None
+            if history_limit is not None:
+                projection = {"conversation_history": {"$slice": -history_limit} if history_limit else 0}
+            
+            # Skip the push if this turn was already recorded
+            query = {"_id": ObjectId(chat_id)}
+            if turn_id:
+                query["conversation_history.turnId"] = {"$ne": turn_id}
+            
+            # Update chat in MongoDB and get the updated document in the same round-trip
             chats_collection = get_mongodb_collection('chats')
-            result = chats_collection.update_one(
-                {"_id": ObjectId(chat_id)},
+            chat = chats_collection.find_one_and_update(
+                query,
                 {
                     "$push": {"conversation_history": conversation_entry.model_dump()},
                     "$set": {"updated_at": datetime.utcnow()}
-                }
+                },
+                projection=projection,
+                return_document=ReturnDocument.AFTER
             )
+            ChatUtils._invalidate_chat_cache(chat_id)
             
-            if result.modified_count > 0:
+            if chat:
+                chat['_id'] = str(chat['_id'])
                 logger.info(f"[ChatUtils] Added prompt to chat {chat_id}")
-                return True
+                return chat
             else:
-                logger.warning(f"[ChatUtils] No chat found with ID {chat_id}")
-                return False
+                logger.warning(f"[ChatUtils] No chat found with ID {chat_id} (or turn already recorded)")
+                return None
                 
         except Exception as e:
             logger.error(f"[ChatUtils] Error adding prompt to chat: {e}")
-            return False
+            return None
     
     @staticmethod
-    def add_assistant_response_to_chat(chat_id: str, response: str, citations: List[Dict[str, Any]] = None) -> bool:
+    def add_assistant_response_to_chat(chat_id: str, response: str, citations: List[Dict[str, Any]] = None,
+                                       turn_id: Optional[str] = None) -> bool:
         """
         Add assistant response to the latest conversation entry in chat
         
@@ -115,76 +184,182 @@ class ChatUtils:
             chat_id: Chat ObjectId as string
             response: Assistant's response text
             citations: List of citations as dictionaries
+            turn_id: Optional turn ID of the entry to update (avoids looking up the latest entry)
             
         Returns:
             True if successful, False if failed
         """
         try:
             # Process citations
-            citation_models = []
-            if citations:
-                for citation in citations:
-                    citation_model = CitationModel(
-                        citationId=str(ObjectId()),
-                        source=citation.get('source', ''),
-                        text=citation.get('text', ''),
-                        page=citation.get('page'),
-                        link=citation.get('link')
-                    )
-                    citation_models.append(citation_model.dict())
-            
-            # Update the latest conversation entry in the chat
+            citation_models = ChatUtils._build_citation_models(citations)
+            
             chats_collection = get_mongodb_collection('chats')
             
-            # First, get the chat to find the last conversation entry
-            chat_doc = chats_collection.find_one({"_id": ObjectId(chat_id)})
-            if not chat_doc or not chat_doc.get('conversation_history'):
-                logger.error(f"[ChatUtils] No conversation history found for chat {chat_id}")
+            if turn_id:
+                # Update the entry of this turn directly (single round-trip)
+                result = chats_collection.update_one(
+                    {"_id": ObjectId(chat_id), "conversation_history.turnId": turn_id},
+                    {
+                        "$set": {
+                            "conversation_history.$.assistant": response,
+                            "conversation_history.$.citations": citation_models,
+                            "updated_at": datetime.utcnow()
+                        }
+                    }
+                )
+            else:
+                # First, get the chat to find the last conversation entry
+                chat_doc = chats_collection.find_one(
+                    {"_id": ObjectId(chat_id)},
+                    {"conversation_history": {"$slice": -1}, "history_length": {"$size": "$conversation_history"}}
+                )
+                if not chat_doc or not chat_doc.get('conversation_history'):
+                    logger.error(f"[ChatUtils] No conversation history found for chat {chat_id}")
+                    return False
+                
+                # Update only the last conversation entry
+                last_index = chat_doc['history_length'] - 1
+                result = chats_collection.update_one(
+                    {"_id": ObjectId(chat_id)},
+                    {
+                        "$set": {
+                            f"conversation_history.{last_index}.assistant": response,
+                            f"conversation_history.{last_index}.citations": citation_models,
+                            "updated_at": datetime.utcnow()
+                        }
+                    }
+                )
+            ChatUtils._invalidate_chat_cache(chat_id)
+            
+            if result.modified_count > 0:
+                logger.info(f"[ChatUtils] Added assistant response to chat {chat_id}")
+                return True
+            else:
+                logger.warning(f"[ChatUtils] Failed to update assistant response for chat {chat_id}")
                 return False
+                
+        except Exception as e:
+            logger.error(f"[ChatUtils] Error adding assistant response to chat: {e}")
+            return False
+    
+    @staticmethod
+    def append_turn(chat_id: str, user_prompt: str, response: str,
+                    citations: List[Dict[str, Any]] = None, turn_id: Optional[str] = None) -> bool:
+        """
+        Add a complete conversation entry (prompt and assistant response) in a single write
+        
+        Args:
+            chat_id: Chat ObjectId as string
+            user_prompt: User's message text
+            response: Assistant's response text
+            citations: List of citations as dictionaries
+            turn_id: Optional unique turn ID; a retried write with the same ID is not duplicated
             
-            # Update only the last conversation entry
-            last_index = len(chat_doc['conversation_history']) - 1
+        Returns:
+            True if successful, False if failed
+        """
+        try:
+            conversation_entry = ConversationEntry(
+                turnId=turn_id,
+                timestamp=datetime.utcnow(),
+                user=user_prompt,
+                assistant=response,
+                uploads=[],
+                citations=[]
+            ).model_dump()
+            conversation_entry["citations"] = ChatUtils._build_citation_models(citations)
+            
+            # Skip the push if this turn was already recorded
+            query = {"_id": ObjectId(chat_id)}
+            if turn_id:
+                query["conversation_history.turnId"] = {"$ne": turn_id}
+            
+            chats_collection = get_mongodb_collection('chats')
             result = chats_collection.update_one(
-                {"_id": ObjectId(chat_id)},
+                query,
                 {
-                    "$set": {
-                        f"conversation_history.{last_index}.assistant": response,
-                        f"conversation_history.{last_index}.citations": citation_models,
-                        "updated_at": datetime.utcnow()
-                    }
+                    "$push": {"conversation_history": conversation_entry},
+                    "$set": {"updated_at": datetime.utcnow()}
                 }
             )
+            ChatUtils._invalidate_chat_cache(chat_id)
             
             if result.modified_count > 0:
-                logger.info(f"[ChatUtils] Added assistant response to chat {chat_id}")
+                logger.info(f"[ChatUtils] Added conversation turn to chat {chat_id}")
                 return True
             else:
-                logger.warning(f"[ChatUtils] Failed to update assistant response for chat {chat_id}")
+                logger.warning(f"[ChatUtils] No chat found with ID {chat_id} (or turn already recorded)")
                 return False
                 
         except Exception as e:
-            logger.error(f"[ChatUtils] Error adding assistant response to chat: {e}")
+            logger.error(f"[ChatUtils] Error adding conversation turn to chat: {e}")
             return False
     
     @staticmethod
-    def get_chat(chat_id: str) -> Optional[Dict[str, Any]]:
+    def get_turn(chat_id: str, turn_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a single conversation entry of a chat by its turn ID
+        
+        Args:
+            chat_id: Chat ObjectId as string
+            turn_id: Unique turn ID
+            
+        Returns:
+            Conversation entry or None if the turn is not recorded
+        """
+        try:
+            chats_collection = get_mongodb_collection('chats')
+            chat = chats_collection.find_one(
+                {"_id": ObjectId(chat_id), "conversation_history.turnId": turn_id},
+                {"conversation_history.$": 1}
+            )
+            
+            if chat and chat.get('conversation_history'):
+                return chat['conversation_history'][0]
+            return None
+            
+        except Exception as e:
+            logger.error(f"[ChatUtils] Error getting turn: {e}")
+            return None
+    
+    @staticmethod
+    def get_chat(chat_id: str, history_limit: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """
         Get chat by ID
         
+        Results are cached for a couple of seconds; writes through ChatUtils invalidate them.
+        
         Args:
             chat_id: Chat ObjectId as string
+            history_limit: Optional number of most recent history entries to return
+                           (0 returns an empty history, None returns the full history)
             
         Returns:
             Chat document or None
         """
         try:
+            cache_key = (chat_id, history_limit)
+            with _chat_cache_lock:
+                cached_chat = _chat_cache.get(cache_key)
+                generation = _chat_generations.get(chat_id, 0)
+            if cached_chat is not None:
+                return dict(cached_chat)
+            
+            # Truncate conversation history in MongoDB instead of shipping the full array
+            projection = None
+            if history_limit is not None:
+                projection = {"conversation_history": {"$slice": -history_limit} if history_limit else 0}
+            
             chats_collection = get_mongodb_collection('chats')
-            chat = chats_collection.find_one({"_id": ObjectId(chat_id)})
+            chat = chats_collection.find_one({"_id": ObjectId(chat_id)}, projection)
             
             if chat:
                 # Convert ObjectId to string for JSON serialization
                 chat['_id'] = str(chat['_id'])
-                return chat
+                with _chat_cache_lock:
+                    if _chat_generations.get(chat_id, 0) == generation:
+                        _chat_cache[cache_key] = chat
+                return dict(chat)
             return None
             
         except Exception as e:
@@ -244,6 +419,7 @@ class ChatUtils:
             
             # Delete the chat
             result = chats_collection.delete_one({"_id": ObjectId(chat_id)})
+            ChatUtils._invalidate_chat_cache(chat_id)
             
             if result.deleted_count > 0:
                 # Remove chat from user's chat list if user_id exists
@@ -4,12 +4,14 @@ ChromaDB utility functions for vector database operations
 
 import os
 import uuid
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import chromadb
+from chromadb.config import Settings
 from bson import ObjectId
 
-from config.chroma import CHROMA_DB_PATH
+from config.chroma import CHROMA_DB_PATH, CHROMA_HTTP_HOST, CHROMA_HTTP_PORT
 from config.mongodb import get_mongodb_collection
 from models.document import DocumentModel
 from utils.doc_workflow import DocProcessor
@@ -28,7 +30,15 @@ class ChromaUtils:
     
     def __init__(self):
         """Initialize ChromaUtils with ChromaDB client and embedder"""
-        self.chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+        if CHROMA_HTTP_HOST:
+            # Shared Chroma server: many workers use one index instead of each opening the embedded store
+            self.chroma_client = chromadb.HttpClient(
+                host=CHROMA_HTTP_HOST,
+                port=CHROMA_HTTP_PORT,
+                settings=Settings(anonymized_telemetry=False)
+            )
+        else:
+            self.chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
         self.doc_processor = DocProcessor()
         self.embedder = HuggingFaceEndpointEmbeddings(
             model="sentence-transformers/all-MiniLM-L6-v2",
@@ -229,6 +239,27 @@ class ChromaUtils:
         Returns:
             Dictionary with query results and relevant chunks
         """
+        return self.query_chat_docs_batch(chat_id, [query], n_results)
+
+    def query_chat_docs_batch(self, chat_id: str, queries: List[str], n_results: int = 7,
+                              rrf_k: int = 60) -> Dict[str, Any]:
+        """
+        Query a chat's vector database with several query texts in one round-trip
+        
+        All queries are embedded in a single batch and sent as one ChromaDB query;
+        the per-query rankings are fused with Reciprocal Rank Fusion.
+        
+        Args:
+            chat_id: Chat ID to query documents for
+            queries: Search query strings (the first one is the primary query)
+            n_results: Number of results to return
+            rrf_k: RRF rank constant
+            
+        Returns:
+            Dictionary with query results and relevant chunks
+        """
+        query = queries[0] if queries else ''
+        
         try:
             collection_name = f"{chat_id.replace('/', '_').replace('-', '_')}_docs"
             
@@ -244,29 +275,48 @@ class ChromaUtils:
                     'message': 'No documents found for this chat'
                 }
             
-            # Generate query embedding
-            query_embedding = self.embedder.embed_query(query)
+            # Generate query embeddings in one batch
+            if len(queries) == 1:
+                query_embeddings = [self.embedder.embed_query(query)]
+            else:
+                query_embeddings = self.embedder.embed_documents(queries)
             
-            # Query the collection
+            # Query the collection once for all embeddings
             results = collection.query(
-                query_embeddings=[query_embedding],
+                query_embeddings=query_embeddings,
                 n_results=n_results
             )
             
+            # Fuse per-query rankings (RRF); with a single query this keeps Chroma's order
+            fused_chunks: Dict[str, Dict[str, Any]] = {}
+            for q_idx in range(len(results['ids'] or [])):
+                for i, chunk_id in enumerate(results['ids'][q_idx]):
+                    similarity = 1 - results['distances'][q_idx][i]  # Convert distance to similarity
+                    rrf_score = 1.0 / (rrf_k + i + 1)
+                    
+                    if chunk_id in fused_chunks:
+                        fused = fused_chunks[chunk_id]
+                        fused['rrf_score'] += rrf_score
+                        fused['similarity_score'] = max(fused['similarity_score'], similarity)
+                    else:
+                        fused_chunks[chunk_id] = {
+                            'chunk_id': chunk_id,
+                            'text': results['documents'][q_idx][i],
+                            'similarity_score': similarity,
+                            'metadata': results['metadatas'][q_idx][i] if results['metadatas'] else {},
+                            'rrf_score': rrf_score
+                        }
+            
             # Format results
-            relevant_chunks = []
-            if results['ids'] and len(results['ids'][0]) > 0:
-                for i in range(len(results['ids'][0])):
-                    chunk_data = {
-                        'chunk_id': results['ids'][0][i],
-                        'text': results['documents'][0][i],
-                        'similarity_score': 1 - results['distances'][0][i],  # Convert distance to similarity
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                        'relevance_rank': i + 1
-                    }
-                    relevant_chunks.append(chunk_data)
-            
-            logger.info(f"Query executed for chat {chat_id}: Found {len(relevant_chunks)} relevant chunks")
+            relevant_chunks = sorted(
+                fused_chunks.values(),
+                key=lambda chunk: (chunk['rrf_score'], chunk['similarity_score']),
+                reverse=True
+            )[:n_results]
+            for rank, chunk_data in enumerate(relevant_chunks):
+                chunk_data['relevance_rank'] = rank + 1
+            
+            logger.info(f"Query executed for chat {chat_id} with {len(queries)} queries: Found {len(relevant_chunks)} relevant chunks")
             
             return {
                 'success': True,
@@ -488,6 +538,20 @@ class ChromaUtils:
             }
 
 
+@lru_cache(maxsize=1)
+def get_chroma_utils() -> ChromaUtils:
+    """
+    Get the shared ChromaUtils instance
+    
+    Reuses one ChromaDB client (and its HNSW index handles) and one embedder
+    instead of reopening them for every caller.
+    
+    Returns:
+        Shared ChromaUtils instance
+    """
+    return ChromaUtils()
+
+
 # Convenience functions for easy usage
 def create_chat_db(chat_id: str) -> Dict[str, Any]:
     """
@@ -499,7 +563,7 @@ def create_chat_db(chat_id: str) -> Dict[str, Any]:
     Returns:
         Creation result dictionary
     """
-    chroma_utils = ChromaUtils()
+    chroma_utils = get_chroma_utils()
     return chroma_utils.create_chat_vector_db(chat_id)
 
 
@@ -517,7 +581,7 @@ def upload_document_to_chat(chat_id: str, temp_file_path: str, filename: str,
     Returns:
         Upload result dictionary
     """
-    chroma_utils = ChromaUtils()
+    chroma_utils = get_chroma_utils()
     return chroma_utils.upload_document(chat_id, temp_file_path, filename, user_id)
 
 
@@ -533,7 +597,7 @@ def query_documents(chat_id: str, query: str, n_results: int = 5) -> Dict[str, A
     Returns:
         Query result dictionary
     """
-    chroma_utils = ChromaUtils()
+    chroma_utils = get_chroma_utils()
     return chroma_utils.query_chat_docs(chat_id, query, n_results)
 
 
@@ -544,7 +608,7 @@ def get_all_chat_databases() -> Dict[str, Any]:
     Returns:
         Dictionary with all chat databases information
     """
-    chroma_utils = ChromaUtils()
+    chroma_utils = get_chroma_utils()
     return chroma_utils.get_all_chat_dbs()
 
 
@@ -5,21 +5,79 @@ Functions to prepare data for LLM consumption by removing unnecessary metadata
 
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from functools import lru_cache
+import hashlib
 import logging
+import numpy as np
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=128)
+def _build_citation_automaton(citation_patterns: tuple):
+    """
+    Build an Aho-Corasick automaton over the citation patterns of a RAG context
+    
+    Cached on the patterns, so the automaton is reused while the context is unchanged
+    
+    Args:
+        citation_patterns: Tuple of (document_name, leading_words) per context item
+        
+    Returns:
+        Automaton mapping each pattern to the set of context indices it belongs to,
+        or None if there are no non-empty patterns (an empty automaton cannot be searched)
+    """
+    pattern_indices: Dict[str, set] = {}
+    for i, (document, words) in enumerate(citation_patterns):
+        for pattern in (document, *words):
+            if pattern:
+                pattern_indices.setdefault(pattern, set()).add(i)
+    
+    if not pattern_indices:
+        return None
+    
+    automaton = ahocorasick.Automaton()
+    for pattern, indices in pattern_indices.items():
+        automaton.add_word(pattern, frozenset(indices))
+    automaton.make_automaton()
+    return automaton
+
+
 class LLMContextFormatter:
     """Utility class for formatting data for LLM context"""
     
     @staticmethod
-    def format_rag_context(chroma_results: Dict[str, Any]) -> List[Dict[str, str]]:
+    def _chunk_sort_key(chunk: Dict[str, Any]) -> tuple:
+        """
+        Deterministic ordering key for a retrieved chunk: (doc_id, chunk_index, content hash)
+        """
+        metadata = chunk.get('metadata') or {}
+        chunk_id = str(chunk.get('chunk_id', ''))
+        
+        # chunk_id is "<doc_id>_<chunk_index>" (see DocProcessor.process_pdf)
+        doc_id, _, index = chunk_id.rpartition('_')
+        chunk_index = int(index) if index.isdigit() else 0
+        
+        return (
+            str(metadata.get('doc_id') or doc_id),
+            chunk_index,
+            hashlib.sha256(chunk.get('text', '').encode('utf-8')).hexdigest()
+        )
+    
+    @staticmethod
+    def format_rag_context(chroma_results: Dict[str, Any], stable_order: bool = False) -> List[Dict[str, str]]:
         """
         Format ChromaDB query results for LLM context
         
         Args:
             chroma_results: Raw results from ChromaDB query (from query_chat_docs)
+            stable_order: Sort chunks by document and position instead of relevance rank,
+                          so the same chunk set always yields the same context (prompt caching)
             
         Returns:
             List of context items with document and text only
@@ -32,6 +90,8 @@ class LLMContextFormatter:
             
             # Handle the new format from query_chat_docs
             relevant_chunks = chroma_results.get('relevant_chunks', [])
+            if stable_order:
+                relevant_chunks = sorted(relevant_chunks, key=LLMContextFormatter._chunk_sort_key)
             
             for chunk in relevant_chunks:
                 text = chunk.get('text', '').strip()
@@ -120,17 +180,36 @@ class LLMContextFormatter:
         """
         try:
             citations = []
+            if not rag_context or not assistant_response:
+                return citations
+            
+            response_lower = assistant_response.lower()
+            
+            # A context item is referenced if its document name or one of its first
+            # 10 words occurs in the response; all patterns are matched in one pass
+            citation_patterns = tuple(
+                (item.get("document", "").lower(), tuple(item.get("text", "").lower().split()[:10]))
+                for item in rag_context
+            )
+            if ahocorasick is not None:
+                automaton = _build_citation_automaton(citation_patterns)
+                if automaton is None:
+                    return citations
+                
+                referenced = set()
+                for _, indices in automaton.iter(response_lower):
+                    referenced.update(indices)
+            else:
+                referenced = {
+                    i for i, (document, words) in enumerate(citation_patterns)
+                    if (document and document in response_lower) or any(word in response_lower for word in words)
+                }
             
             for i, context_item in enumerate(rag_context):
                 document = context_item.get("document", "")
                 text = context_item.get("text", "")
                 
-                # Simple check if the context might be referenced in the response
-                # This is a basic implementation - could be improved with more sophisticated matching
-                if document and text and (
-                    document.lower() in assistant_response.lower() or 
-                    any(word in assistant_response.lower() for word in text.lower().split()[:10])
-                ):
+                if document and text and i in referenced:
                     citations.append({
                         "citationId": f"auto_citation_{i}",
                         "source": document,
@@ -207,32 +286,28 @@ class LLMContextFormatter:
             if total_tokens <= max_tokens:
                 return rag_context, chat_history
             
+            # Per-item token usage, for the cumulative cutoffs below
+            context_counts = np.fromiter(
+                (LLMContextFormatter.estimate_token_count(item.get("text", "")) for item in rag_context),
+                dtype=np.int64, count=len(rag_context)
+            )
+            history_counts = np.fromiter(
+                (LLMContextFormatter.estimate_token_count(msg.get("content", "")) for msg in chat_history),
+                dtype=np.int64, count=len(chat_history)
+            )
+            
             # If exceeding limits, prioritize recent history and most relevant context
-            # Keep at least 50% for context, 50% for history
-            max_context_tokens = max_tokens // 2
-            max_history_tokens = max_tokens // 2
-            
-            # Truncate context if needed
-            truncated_context = []
-            current_context_tokens = 0
-            for item in rag_context:
-                item_tokens = LLMContextFormatter.estimate_token_count(item.get("text", ""))
-                if current_context_tokens + item_tokens <= max_context_tokens:
-                    truncated_context.append(item)
-                    current_context_tokens += item_tokens
-                else:
-                    break
-            
-            # Truncate history if needed (keep most recent)
-            truncated_history = []
-            current_history_tokens = 0
-            for msg in reversed(chat_history):
-                msg_tokens = LLMContextFormatter.estimate_token_count(msg.get("content", ""))
-                if current_history_tokens + msg_tokens <= max_history_tokens:
-                    truncated_history.insert(0, msg)
-                    current_history_tokens += msg_tokens
-                else:
-                    break
+            # Keep at least 50% for context, 50% for history (the whole budget if the other is empty)
+            max_context_tokens = max_tokens // 2 if chat_history else max_tokens
+            max_history_tokens = max_tokens // 2 if rag_context else max_tokens
+            
+            # Truncate context if needed (keep the leading items that fit)
+            context_cutoff = int(np.searchsorted(np.cumsum(context_counts), max_context_tokens, side='right'))
+            truncated_context = rag_context[:context_cutoff]
+            
+            # Truncate history if needed (keep the most recent messages that fit)
+            history_keep = int(np.searchsorted(np.cumsum(history_counts[::-1]), max_history_tokens, side='right'))
+            truncated_history = chat_history[len(chat_history) - history_keep:]
             
             logger.info(f"[LLMContextFormatter] Truncated context from {len(rag_context)} to {len(truncated_context)} items")
             logger.info(f"[LLMContextFormatter] Truncated history from {len(chat_history)} to {len(truncated_history)} messages")